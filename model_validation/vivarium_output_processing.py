@@ -1,5 +1,5 @@
+import numpy as np
 import pandas as pd
-import collections
 
 VALUE_COLUMN = 'value'
 DRAW_COLUMN  = 'input_draw'
@@ -18,64 +18,59 @@ def set_global_index_columns(index_columns:list)->None:
     set_global_index_columns(['location']+lsff_output_processing.INDEX_COLUMNS)
     """
     global INDEX_COLUMNS
-    INDEX_COLUMNS = index_columns
+    # Store a copy so that later changes to the caller's list don't silently change the behavior of this module
+    INDEX_COLUMNS = list(index_columns)
 
 def _ensure_iterable(colnames, df, default=None):
     """Wrap a single column name in a list, or return colnames unaltered if it's already a list of column names.
     If colnames is None, its value will first be set to the default value (e.g. pass `default=[]` to default to
     an empty list when colnames is None).
-    """
-
-    def method1(colnames, df):
-        """Method 1 (doesn't depend on df): Assume that if colnames has a type that is in a whitelist of
-        allowed iterable types, then it is an iterable of column names, and otherwise it must be a single
-        column name.
-        """
-        if not isinstance(colnames, (list, pd.Index)):
-            colnames = [colnames]
-        return colnames
-
-    def method2(colnames, df):
-        """Method 2: Assume that if colnames is hashable it represents a single column name,
-        and otherwise it must be an iterable of column names. (This method doesn't allow tuples of column
-        names since tuples are hashable.)
-        """
-        if isinstance(colnames, collections.Hashable):
-            # This line could still raise an 'unhashable type' TypeError if e.g. colnames is a tuple
-            # that contains an unhashable type
-            if colnames in df: # assume colnames is a single column name in df
-                colnames = [colnames]
-            else: # Assume colnames is supposed to be a single column name
-                raise KeyError(f"Key {colnames} not in the DataFrame")
-        elif not isinstance(colnames, collections.Iterable): # assume colname is an iterable of column names
-            raise ValueError(f"{colnames} must be a single column name in df or an iterable of column names")
-        return colnames
-
-    def method3(colnames, df):
-        """Method 3: Assume that if colnames is a string or is a hashable object that is in the dataframe's columns
-        (e.g. a tuple), then it represents a single column namee. Otherwise it must be an iterable of column names.
-        (This method allows tuples of column names.)
-        """
-        if isinstance(colnames, collections.Hashable):
-            # This line could still raise an 'unhashable type' TypeError if e.g. colnames is a tuple
-            # that contains an unhashable type
-            if colnames in df: # assume colnames is a single column name in df
-                colnames = [colnames]
-            elif isinstance(colnames, str): # Assume colnames is supposed to be a single column name
-                raise KeyError(f"string {colnames} not in the DataFrame")
-        elif not isinstance(colnames, collections.Iterable): # assume colname is an iterable of column names
-            raise ValueError(f"{colnames} must be a single column name in df or an iterable of column names")
-        return colnames
 
+    This assumes that if colnames has a type that is in a whitelist of allowed iterable types, then it is an
+    iterable of column names, and otherwise it must be a single column name (doesn't depend on df).
+    """
     if colnames is None: colnames = default
-    return method1(colnames, df) # Go with the most restrictive method for now
+    if isinstance(colnames, (list, pd.Index)):
+        return colnames
+    return [colnames]
 
 def _ensure_columns_not_levels(df, column_list=None):
-    """Move Index levels into columns to enable passing index level names as well as column names."""
-    if column_list is None: column_list = []
-    if df.index.nlevels > 1 or df.index.name in column_list:
-        df = df.reset_index()
-    return df
+    """Move Index levels into columns to enable passing index level names as well as column names.
+    If the index has a single level that isn't referenced in column_list (e.g. a default RangeIndex),
+    df is returned as is, to avoid making an unnecessary copy.
+    """
+    index = df.index
+    # Check the cheap conditions first, since an unnamed single-level index is by far the most common case
+    if index.nlevels == 1 and (index.name is None or column_list is None or index.name not in column_list):
+        return df
+    return df.reset_index()
+
+def _factorize_keys(df, by):
+    """Factorize each column in `by` and combine the results into a single flat integer code for each row.
+    The unique values of each column are sorted, so that sorting by the flat codes gives the same order of
+    groups as groupby(sort=True). Rows with a NaN key are dropped, as in groupby(dropna=True).
+
+    Returns a tuple (keep, flat_codes, levels, shape), where `keep` is a boolean mask of the rows that were
+    not dropped, `flat_codes` contains the codes of the kept rows, `levels` contains the unique values of
+    each column, and `shape` contains the number of unique values of each column. Returns None if there are
+    too many possible combinations of keys to fit in a flat int64 code.
+    """
+    level_codes, levels = zip(*(pd.factorize(df[col], sort=True) for col in by))
+    shape = tuple(len(level) for level in levels)
+    if np.prod(shape, dtype=float) >= np.iinfo(np.int64).max:
+        return None
+    # Rows with NaN keys are assigned code -1
+    keep = np.logical_and.reduce([codes >= 0 for codes in level_codes])
+    flat_codes = np.ravel_multi_index([codes[keep] for codes in level_codes], shape)
+    return keep, flat_codes, levels, shape
+
+def _groupby_sum(df, by, value_cols, as_index=True):
+    """Returns df.groupby(by, observed=True, as_index=as_index)[value_cols].sum().
+    `by` and `value_cols` are converted to lists first, since groupby would treat a pd.Index as an array
+    of keys rather than a list of column labels.
+    """
+    # observed=True needed for Categorical data
+    return df.groupby(list(by), observed=True, as_index=as_index)[list(value_cols)].sum()
 
 def list_columns(*column_groups, df=None, default=None)->list:
     """Retuns a single list of column names from an arbitrary number
@@ -92,6 +87,21 @@ def list_columns(*column_groups, df=None, default=None)->list:
     """
     return [col for col_or_cols in column_groups for col in _ensure_iterable(col_or_cols, df, default=default)]
 
+def as_categorical(df, cols=None):
+    """Returns a copy of df with the specified string columns converted to Categorical.
+    If cols is None, all string (or object dtype) columns are converted. Columns with other dtypes are
+    left unaltered.
+
+    The identifier columns of Vivarium output (e.g. scenario, sex, age, cause, measure) have only a few
+    distinct values, so converting them once (e.g. right after loading the data) saves memory, and
+    speeds up subsequent calls to `stratify`, `marginalize`, `ratio`, etc., which can then group by the
+    integer category codes instead of hashing every string.
+    """
+    cols = df.columns if cols is None else _ensure_iterable(cols, df)
+    return df.assign(**{
+        col: df[col].astype('category') for col in cols if pd.api.types.is_string_dtype(df[col].dtype)
+    })
+
 def value(df, include=None, exclude=None, value_cols=VALUE_COLUMN):
     """Set the index of the dataframe so that its only column(s) is (are) value_cols.
     This is useful for performing arithmetic on the dataframe, e.g. value(df1) + value(df2),
@@ -112,6 +122,7 @@ def value(df, include=None, exclude=None, value_cols=VALUE_COLUMN):
     value_cols = _ensure_iterable(value_cols, df)
     if include is None:
         exclude = _ensure_iterable(exclude, df, default=[])
+        # This must be a list, not an Index, because set_index would treat an Index as an array of keys
         index_cols = df.columns.difference([*value_cols, *exclude]).to_list()
     elif exclude is not None:
         raise ValueError(
@@ -120,7 +131,13 @@ def value(df, include=None, exclude=None, value_cols=VALUE_COLUMN):
     else:
         include = _ensure_iterable(include, df)
         index_cols = [*include, *INDEX_COLUMNS]
-    return df.set_index(index_cols)[value_cols]
+    # Select only the columns we need (which makes a copy), then set the index of the copy in place,
+    # rather than copying every column of df in set_index and then copying value_cols again.
+    # De-duplicate the selection, since index_cols may repeat a column (e.g. if `include` contains a
+    # column in INDEX_COLUMNS), but still pass all of index_cols to set_index.
+    df = df[list(dict.fromkeys([*index_cols, *value_cols]))]
+    df.set_index(index_cols, inplace=True)
+    return df
 
 def marginalize(df:pd.DataFrame, marginalized_cols, value_cols=VALUE_COLUMN, reset_index=True)->pd.DataFrame:
     """Sum the values of a dataframe over the specified columns to marginalize out.
@@ -163,9 +180,8 @@ def marginalize(df:pd.DataFrame, marginalized_cols, value_cols=VALUE_COLUMN, res
     value_cols = _ensure_iterable(value_cols, df)
     # Move Index levels into columns to enable passing index level names as well as column names to marginalize
     df = _ensure_columns_not_levels(df, marginalized_cols)
-    index_cols = df.columns.difference([*marginalized_cols, *value_cols]).to_list()
-    summed_data = df.groupby(index_cols, observed=True)[value_cols].sum() # observed=True needed for Categorical data
-    return summed_data.reset_index() if reset_index else summed_data
+    index_cols = df.columns.difference([*marginalized_cols, *value_cols])
+    return _groupby_sum(df, index_cols, value_cols, as_index=not reset_index)
 
 def stratify(df: pd.DataFrame, strata, value_cols=VALUE_COLUMN, reset_index=True)->pd.DataFrame:
     """Sum the values of the dataframe so that the reult is stratified by the specified strata.
@@ -214,8 +230,7 @@ def stratify(df: pd.DataFrame, strata, value_cols=VALUE_COLUMN, reset_index=True
     strata = _ensure_iterable(strata, df)
     value_cols = _ensure_iterable(value_cols, df)
     index_cols = [*strata, *INDEX_COLUMNS]
-    summed_data = df.groupby(index_cols, observed=True)[value_cols].sum()
-    return summed_data.reset_index() if reset_index else summed_data
+    return _groupby_sum(df, index_cols, value_cols, as_index=not reset_index)
 
 def aggregate_categories(df, category_col, supercategory_to_categories, append=False):
     """Aggregates (by summing) the values corresponding to the specified categories in
@@ -366,13 +381,44 @@ def ratio(
      ratio : DataFrame
          The ratio or rate data = numerator / denominator.
     """
-    # Ensure that index columns in numerator and denominator are columns not index levels,
-    # to guarantee that _ensure_iterable will work and df[measure_col] will work.
-    numerator = _ensure_columns_not_levels(numerator)
-    denominator = _ensure_columns_not_levels(denominator)
+    return ratio_many(
+        {None: numerator},
+        denominator,
+        strata,
+        multiplier=multiplier,
+        numerator_broadcast=numerator_broadcast,
+        denominator_broadcast=denominator_broadcast,
+        value_col=value_col,
+        measure_col=measure_col,
+        dropna=dropna,
+        record_inputs=record_inputs,
+        reset_index=reset_index,
+    )[None]
+
+def ratio_many(
+    numerators: dict,
+    denominator: pd.DataFrame,
+    strata,
+    multiplier=1,
+    numerator_broadcast=None,
+    denominator_broadcast=None,
+    value_col=VALUE_COLUMN,
+    measure_col=MEASURE_COLUMN,
+    dropna=False,
+    record_inputs=None,
+    reset_index=True,
+)-> dict:
+    """
+    Compute several ratios or rates with the same denominator, e.g. deaths, ylls, and ylds per person-time.
+    `numerators` is a dictionary mapping a key (e.g. the measure name) to the numerator DataFrame for
+    each ratio, and the return value is a dictionary mapping the same keys to the corresponding ratios.
+    The remaining parameters are the same as for `ratio` and apply to every ratio.
+
+    This is equivalent to calling `ratio` once for each numerator, but the denominator is only stratified once.
+    """
     # Ensure that numerator_broadcast and denominator_broadcast are iterables of column names
-    numerator_broadcast = _ensure_iterable(numerator_broadcast, numerator, default=[])
-    denominator_broadcast = _ensure_iterable(denominator_broadcast, denominator, default=[])
+    numerator_broadcast = _ensure_iterable(numerator_broadcast, None, default=[])
+    denominator_broadcast = _ensure_iterable(denominator_broadcast, None, default=[])
 
     # Avoid potential confusion by requiring common stratification columns to go in strata.
     if len(set(numerator_broadcast) & set(denominator_broadcast)) > 0:
@@ -381,90 +427,155 @@ def ratio(
             " Any column to include in both the numerator and denominator should go in `strata`."
         )
 
+    # Ensure strata is an iterable of column names so it can be concatenated with broadcast columns
+    strata = _ensure_iterable(strata, None)
+    value_col = _ensure_iterable(value_col, None)
+
     # Default behavior is to record inputs only if index is reset
     if record_inputs is None:
         record_inputs = reset_index
 
+    # Ensure that index columns are columns not index levels, to guarantee that df[measure_col] will work.
+    denominator = _ensure_columns_not_levels(denominator)
     if record_inputs:
         # Really I think the 'measure' column should always have a unique value, but
         # currently that is not the case for transition counts...
-        numerator_measure = '|'.join(numerator[measure_col].unique())
         denominator_measure = '|'.join(denominator[measure_col].unique())
+    # Stratify the denominator with broadcast columns included, once for all the numerators
+    denominator = _groupby_sum(denominator, [*strata, *denominator_broadcast, *INDEX_COLUMNS], value_col)
+
+    ratios = {}
+    for key, numerator in numerators.items():
+        numerator = _ensure_columns_not_levels(numerator)
+        if record_inputs:
+            numerator_measure = '|'.join(numerator[measure_col].unique())
+        # Stratify numerator with broadcast columns included
+        numerator = _groupby_sum(numerator, [*strata, *numerator_broadcast, *INDEX_COLUMNS], value_col)
+
+        # Compute the ratio
+        ratio = (numerator / denominator) * multiplier
+
+        # If dropna is True, drop rows where we divided by 0
+        if dropna:
+            ratio.dropna(inplace=True)
+
+        if record_inputs:
+            ratio[f'numerator_{measure_col}'] = numerator_measure
+            ratio[f'denominator_{measure_col}'] = denominator_measure
+            ratio['multiplier'] = multiplier
+
+        if reset_index:
+            ratio.reset_index(inplace=True)
+
+        ratios[key] = ratio
+    return ratios
+
+def _merge_difference(measure, index_columns, identifier_col, minuend_id, subtrahend_id):
+    """Subtract the subtrahend rows of `measure` from the minuend rows by joining them on `index_columns`.
+    Returns a dataframe with columns index_columns + [identifier_col, VALUE_COLUMN].
+
+    `difference` uses this when both minuend_id and subtrahend_id are specified. The branches for a single
+    broadcast id are only reached as a fallback when the broadcast rows contain duplicate keys, since
+    `difference` otherwise looks up the broadcast rows by position.
+    """
+    # Keep the identifier column only for the larger dataframe (or default to the subtrahend dataframe
+    # if neither needs broadcasting), then join the minuend and subtrahend on the remaining columns.
+    # Keys missing from either side give a NaN value. To match subtracting with pandas' index alignment,
+    # the join is outer when there are several index columns (so keys missing from the side with the
+    # identifier column give a NaN identifier), but left when there is only one.
+    how = 'outer' if len(index_columns) > 1 else 'left'
+    if minuend_id is not None:
+        minuend = measure.loc[measure[identifier_col] == minuend_id, [*index_columns, VALUE_COLUMN]]
+        if subtrahend_id is not None:
+            subtrahend_rows = measure[identifier_col] == subtrahend_id
+        else:
+            subtrahend_rows = measure[identifier_col] != minuend_id
+        subtrahend = measure.loc[subtrahend_rows, [*index_columns, identifier_col, VALUE_COLUMN]]
+        difference = subtrahend.merge(minuend, on=index_columns, how=how, suffixes=('_subtrahend', '_minuend'))
+    else:
+        subtrahend = measure.loc[measure[identifier_col] == subtrahend_id, [*index_columns, VALUE_COLUMN]]
+        # Use all values not equal to subtrahend_id for minuend (subtrahend will be broadcast over minuend)
+        minuend = measure.loc[measure[identifier_col] != subtrahend_id, [*index_columns, identifier_col, VALUE_COLUMN]]
+        difference = minuend.merge(subtrahend, on=index_columns, how=how, suffixes=('_minuend', '_subtrahend'))
 
-    # Ensure strata is an iterable of column names so it can be concatenated with broadcast columns
-    strata = _ensure_iterable(strata, denominator)
-    # Stratify numerator and denominator with broadcast columns included
-    numerator = stratify(numerator, [*strata, *numerator_broadcast], value_cols=value_col, reset_index=False)
-    denominator = stratify(denominator, [*strata, *denominator_broadcast], value_cols=value_col, reset_index=False)
-
-    # Compute the ratio
-    ratio = (numerator / denominator) * multiplier
-
-    # If dropna is True, drop rows where we divided by 0
-    if dropna:
-        ratio.dropna(inplace=True)
-
-    if record_inputs:
-        ratio[f'numerator_{measure_col}'] = numerator_measure
-        ratio[f'denominator_{measure_col}'] = denominator_measure
-        ratio['multiplier'] = multiplier
-
-    if reset_index:
-        ratio.reset_index(inplace=True)
-
-    return ratio
+    minuend_col, subtrahend_col = f'{VALUE_COLUMN}_minuend', f'{VALUE_COLUMN}_subtrahend'
+    difference[VALUE_COLUMN] = difference[minuend_col] - difference[subtrahend_col]
+    difference.drop(columns=[minuend_col, subtrahend_col], inplace=True)
+    return difference
 
 def difference(measure:pd.DataFrame, identifier_col:str, minuend_id=None, subtrahend_id=None)->pd.DataFrame:
     """
     Returns the difference of a measure stored in the measure DataFrame, where the
     rows for the minuend (that which is diminished) and subtrahend (that which is subtracted)
-    are determined by the values in identifier_col
+    are determined by the values in identifier_col.
+
+    If only one of `minuend_id` and `subtrahend_id` is specified, the corresponding rows are broadcast
+    over the rows with all other identifiers. Rows whose key (i.e. the values in all columns except
+    identifier_col and VALUE_COLUMN) is missing from either the minuend or the subtrahend get a NaN value.
+    If there are several key columns, keys missing from the larger (non-broadcast) side also get a row,
+    with a NaN identifier, and the result is sorted by key (keeping the input order within each key).
+    If there is a single key column, these keys are dropped, and the rows keep the input order.
     """
-    if minuend_id is not None:
-        minuend = measure[measure[identifier_col] == minuend_id]
-        if subtrahend_id is not None:
-            subtrahend = measure[measure[identifier_col] == subtrahend_id]
+    # Columns to match when subtracting subtrahend from minuend
+    index_columns = measure.columns.difference([identifier_col, VALUE_COLUMN], sort=False).to_list()
+
+    if (minuend_id is None) != (subtrahend_id is None):
+        # One of the minuend or subtrahend is broadcast over all the rows with a different identifier
+        # (e.g. the baseline scenario in `averted`). Look up the position of the matching broadcast row
+        # for each of the other rows, then subtract with a single numpy operation.
+        is_broadcast = (measure[identifier_col] == (subtrahend_id if minuend_id is None else minuend_id)).to_numpy()
+        keys = pd.MultiIndex.from_frame(measure[index_columns])
+        broadcast_keys = keys[is_broadcast]
+        if broadcast_keys.is_unique:
+            indexer = broadcast_keys.get_indexer(keys[~is_broadcast])
+            values = measure[VALUE_COLUMN].to_numpy()
+            broadcast_values = values[is_broadcast]
+            if (indexer < 0).any():
+                # Rows with no matching broadcast row get NaN (the indexer is -1 for these rows)
+                broadcast_values = np.append(broadcast_values, np.nan)
+            broadcast_values = broadcast_values[indexer]
+            other_values = values[~is_broadcast]
+            differences = broadcast_values - other_values if subtrahend_id is None else other_values - broadcast_values
+            # With several index columns, broadcast rows whose key matches none of the other rows also
+            # get a row in the result, with NaN identifier and value
+            if len(index_columns) > 1:
+                is_matched = np.zeros(len(broadcast_keys), dtype=bool)
+                is_matched[indexer[indexer >= 0]] = True
+                unmatched_rows = np.flatnonzero(is_broadcast)[~is_matched]
+            else:
+                unmatched_rows = np.array([], dtype=np.intp)
+            rows = np.concatenate([np.flatnonzero(~is_broadcast), unmatched_rows])
+            difference = measure.iloc[rows][[*index_columns, identifier_col]].reset_index(drop=True)
+            if len(unmatched_rows) > 0:
+                difference[identifier_col] = difference[identifier_col].where(difference.index < len(other_values))
+                differences = np.append(differences, np.full(len(unmatched_rows), np.nan))
+            difference[VALUE_COLUMN] = differences
         else:
-            # Use all values not equal to minuend_id for subtrahend (minuend will be broadcast over subtrahend)
-            subtrahend = measure[measure[identifier_col] != minuend_id]
-    elif subtrahend_id is not None:
-        subtrahend = measure[measure[identifier_col] == subtrahend_id]
-        # Use all values not equal to subtrahend_id for minuend (subtrahend will be broadcast over minuend)
-        minuend = measure[measure[identifier_col] != subtrahend_id]
+            # Duplicate broadcast rows can't be looked up by position, so subtract by joining instead
+            difference = _merge_difference(measure, index_columns, identifier_col, minuend_id, subtrahend_id)
+    elif minuend_id is not None:
+        # Both minuend_id and subtrahend_id are specified
+        difference = _merge_difference(measure, index_columns, identifier_col, minuend_id, subtrahend_id)
     else:
         raise ValueError("At least one of `minuend_id` and `subtrahend_id` must be specified")
 
-    # Columns to match when subtracting subtrahend from minuend
-    # Oh, I just noticed that I could use the Index.difference() method here, which I was unaware of before...
-    index_columns = sorted(set(measure.columns) - set([identifier_col, VALUE_COLUMN]),
-                           key=measure.columns.get_loc)
-
-    minuend = minuend.set_index(index_columns)
-    subtrahend = subtrahend.set_index(index_columns)
-
-    # Add the identifier column to the index of the larger dataframe
-    # (or default to the subtrahend dataframe if neither needs broadcasting).
-    if minuend_id is None:
-        minuend.set_index(identifier_col, append=True, inplace=True)
-    else:
-        subtrahend.set_index(identifier_col, append=True, inplace=True)
-
-    # Subtract DataFrames, not Series, because Series will drop the identifier column from the index
-    # if there is no broadcasting. (Behavior for Series and DataFrames is different - is this a
-    # feature or a bug in pandas?)
-    difference = minuend[[VALUE_COLUMN]] - subtrahend[[VALUE_COLUMN]]
-    difference = difference.reset_index()
+    if len(index_columns) > 1:
+        # Sort by key, keeping the input order within each key, like subtracting with pandas' index alignment
+        difference.sort_values(index_columns, kind='stable', ignore_index=True, inplace=True)
 
     # Add a column to specify what was subtracted from (the minuend) or what was subtracted (the subtrahend)
     colname, value = ('subtracted_from', minuend_id) if minuend_id is not None else ('subtracted_value', subtrahend_id)
-    difference.insert(difference.columns.get_loc(identifier_col)+1, colname, value)
+    # The identifier column comes right after index_columns
+    difference.insert(len(index_columns)+1, colname, value)
 
     return difference
 
 def averted(measure: pd.DataFrame, baseline_scenario: str, scenario_col=None):
     """
     Compute an "averted" measure (e.g. DALYs) or measures by subtracting
-    the intervention value from the baseline value.
+    the intervention value from the baseline value. The baseline is broadcast
+    over all the other scenarios in `measure`, so every intervention scenario
+    is computed in a single subtraction.
 
     Parameters
     ----------
@@ -500,6 +611,7 @@ def describe(df, **describe_kwargs):
         describe_kwargs['percentiles'] = [.025, .975]
     excluded_cols = [DRAW_COLUMN, VALUE_COLUMN]
     df = _ensure_columns_not_levels(df, excluded_cols)
+    # This must be a list, not an Index, because groupby would treat an Index as an array of keys
     groupby_cols = df.columns.difference(excluded_cols).to_list()
     return df.groupby(groupby_cols)[VALUE_COLUMN].describe(**describe_kwargs)
 
@@ -517,6 +629,47 @@ def aggregate_mean_lower_upper(df_or_groupby, lower_rank=0.025, upper_rank=0.975
     def upper(x): return x.quantile(upper_rank)
     return df_or_groupby.agg(['mean', lower, upper])
 
+def describe_mean_lower_upper(df, q=(0.025, 0.975)):
+    """Get the mean, lower, and upper value of `df` grouped by everything except draw and value, where
+    lower and upper are the quantiles in `q`. Equivalent to get_mean_lower_upper(describe(df)) for the
+    default `q`, but only computes the three needed statistics rather than everything in DataFrame.describe().
+    """
+    lower_rank, upper_rank = q
+    excluded_cols = [DRAW_COLUMN, VALUE_COLUMN]
+    df = _ensure_columns_not_levels(df, excluded_cols)
+    groupby_cols = df.columns.difference(excluded_cols).to_list()
+    factorized = _factorize_keys(df, groupby_cols) if len(groupby_cols) > 0 else None
+    if factorized is None:
+        grouped = df.groupby(groupby_cols, observed=True)[VALUE_COLUMN]
+        return aggregate_mean_lower_upper(grouped, lower_rank, upper_rank).reset_index()
+    keep, flat_codes, levels, shape = factorized
+    group_codes, observed_groups = pd.factorize(flat_codes, sort=True)
+    ngroups = len(observed_groups)
+    values = df[VALUE_COLUMN].to_numpy(dtype=float)[keep]
+
+    # Like describe(), ignore NaN values
+    counts = np.bincount(group_codes[~np.isnan(values)], minlength=ngroups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group_codes, weights=np.where(np.isnan(values), 0.0, values), minlength=ngroups) / counts
+
+    # Sort the values within each group (with NaNs last), so that each group's quantiles
+    # can be read off by position, using the same linear interpolation as pandas
+    sorted_values = values[np.lexsort((values, group_codes))]
+    starts = np.r_[0, np.cumsum(np.bincount(group_codes, minlength=ngroups))[:-1]]
+    last = np.maximum(counts - 1, 0)
+    quantiles = []
+    for rank in (lower_rank, upper_rank):
+        position = last * rank
+        below = np.floor(position).astype(np.int64)
+        above = np.minimum(below + 1, last)
+        lower_value, upper_value = sorted_values[starts + below], sorted_values[starts + above]
+        quantile = lower_value + (position - below) * (upper_value - lower_value)
+        quantiles.append(np.where(counts > 0, quantile, np.nan))
+
+    key_codes = np.unravel_index(observed_groups, shape)
+    keys = {col: level.take(codes) for col, level, codes in zip(groupby_cols, levels, key_codes)}
+    return pd.DataFrame({**keys, 'mean': mean, 'lower': quantiles[0], 'upper': quantiles[1]})
+
 def assert_values_equal(df1, df2, **kwargs):
     """Test whether the value columns of df1 and df2 are equal, using all other columns as the index,
     using the `pd.testing.assert_frame_equal` function.